@@ -0,0 +1,100 @@
+# Directory: app/services/content_cache.py
+# Read-through on-disk caches (fetched pages, related search terms) so re-runs skip the network.
+
+import hashlib
+import json
+import sqlite3
+import time
+from typing import List, NamedTuple, Optional
+
+DEFAULT_CACHE_PATH = ".content_cache.sqlite3"
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60  # 7 days, in seconds
+DEFAULT_TERMS_MAX_AGE = 24 * 60 * 60  # related searches drift faster than page content
+
+def _connect(path: str) -> sqlite3.Connection:
+    """
+    Opens the cache database in WAL mode with synchronous=NORMAL: commits then append
+    to the log without an fsync, so per-page puts on the event loop stay cheap. A crash
+    can lose the last few entries, which is fine for a cache.
+    """
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class CachedPage(NamedTuple):
+    html: str
+    text: Optional[str]
+    fetched_at: float
+
+class ContentCache:
+    """
+    SQLite-backed store keyed by sha256(url). Both the raw HTML and the extracted
+    text are kept, so a change to the extraction step can re-extract from disk
+    instead of re-downloading.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_age: float = DEFAULT_MAX_AGE):
+        self.max_age = max_age
+        self._conn = _connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " key TEXT PRIMARY KEY, url TEXT NOT NULL, html TEXT NOT NULL,"
+            " text TEXT, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def get(self, url: str) -> Optional[CachedPage]:
+        """Returns the cached page, or None if it is missing or older than max_age."""
+        row = self._conn.execute(
+            "SELECT html, text, fetched_at FROM pages WHERE key = ?", (self._key(url),)
+        ).fetchone()
+        if row is None or time.time() - row[2] > self.max_age:
+            return None
+        return CachedPage(*row)
+
+    def put(self, url: str, html: str, text: Optional[str]) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO pages (key, url, html, text, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (self._key(url), url, html, text, time.time()),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+class RelatedTermsCache:
+    """
+    SQLite-backed map of normalized seed query -> related search terms, so repeat
+    expansions within the TTL never touch Google.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_age: float = DEFAULT_TERMS_MAX_AGE):
+        self.max_age = max_age
+        self._conn = _connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS related_terms ("
+            " query TEXT PRIMARY KEY, terms TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, query: str) -> Optional[List[str]]:
+        """Returns the cached terms, or None if missing or older than max_age."""
+        row = self._conn.execute(
+            "SELECT terms, fetched_at FROM related_terms WHERE query = ?", (query,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.max_age:
+            return None
+        return json.loads(row[0])
+
+    def put(self, query: str, terms: List[str]) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO related_terms (query, terms, fetched_at) VALUES (?, ?, ?)",
+            (query, json.dumps(terms), time.time()),
+        )
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
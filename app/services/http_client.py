@@ -0,0 +1,81 @@
+# Directory: app/services/http_client.py
+# Shared, pooled HTTP client so every module reuses the same keep-alive connections.
+# OPTIONAL: `pip install h2` to multiplex requests to the same host over one HTTP/2 connection.
+# OPTIONAL: `pip install brotli` so pages can be downloaded br-compressed (smaller than gzip).
+
+import asyncio
+import httpx
+from typing import Optional
+
+try:
+    import h2  # noqa: F401 -- httpx needs it for http2=True
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+try:
+    import brotli  # noqa: F401 -- httpx decodes br bodies only when this (or brotlicffi) is installed
+    BROTLI_AVAILABLE = True
+except ImportError:
+    try:
+        import brotlicffi  # noqa: F401
+        BROTLI_AVAILABLE = True
+    except ImportError:
+        BROTLI_AVAILABLE = False
+
+# Advertising br without a decoder would hand us bodies httpx cannot decompress.
+_ACCEPT_ENCODING = 'gzip, deflate, br' if BROTLI_AVAILABLE else 'gzip, deflate'
+
+# Real desktop browser strings; callers scraping sensitive hosts can rotate through them.
+USER_AGENTS = [
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:121.0) Gecko/20100101 Firefox/121.0',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.2 Safari/605.1.15',
+]
+
+# Headers to mimic a real browser visit
+DEFAULT_HEADERS = {
+    'User-Agent': USER_AGENTS[0],
+    'Accept-Language': 'en-US,en;q=0.9',
+    'Accept-Encoding': _ACCEPT_ENCODING,
+    'Connection': 'keep-alive',
+    'DNT': '1',
+    'Upgrade-Insecure-Requests': '1'
+}
+
+REQUEST_TIMEOUT = 10.0
+
+# Pool sizing: plenty of total sockets, and idle ones stay warm for 30s between bursts.
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the process-wide AsyncClient, creating it on first use.
+    Callers must not close it; connections are reused across requests and calls.
+    Must be called from a running event loop; a new loop (e.g. a later asyncio.run
+    from a scheduler) gets a fresh client, since pooled sockets belong to their loop.
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client_loop = loop
+        _client = httpx.AsyncClient(
+            headers=DEFAULT_HEADERS,
+            http2=HTTP2_AVAILABLE,
+            follow_redirects=True,
+            timeout=REQUEST_TIMEOUT,
+            limits=POOL_LIMITS,
+        )
+    return _client
+
+async def close_client() -> None:
+    """Closes the shared client; call once on application shutdown."""
+    global _client, _client_loop
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
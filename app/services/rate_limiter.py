@@ -0,0 +1,67 @@
+# Directory: app/services/rate_limiter.py
+# Adaptive per-host rate limiting: push as fast as the host tolerates, back off when it pushes back.
+
+import asyncio
+from typing import Optional
+
+class AdaptiveRateLimiter:
+    """
+    Token-bucket limiter with a concurrency cap, whose rate adapts AIMD-style:
+    each success raises it a little, a throttle (429/503) halves it (at most
+    once per window, so a burst of throttled requests counts as one). A
+    Retry-After from the host pauses every caller until it has passed.
+
+    Usage: hold `async with limiter:` for the whole request (including retries)
+    and `await limiter.wait_turn()` before each attempt goes on the wire.
+    """
+    def __init__(self, rate: float = 4.0, max_at_once: int = 8,
+                 min_rate: float = 0.5, max_rate: float = 16.0, increase_step: float = 0.25):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase_step = increase_step
+        self._sem = asyncio.Semaphore(max_at_once)
+        # Loop time at which the next request may start.
+        self._next_slot = 0.0
+        # Loop time before which nobody may start, set by Retry-After.
+        self._paused_until = 0.0
+        # Loop time of the last rate decrease; None until the first throttle.
+        self._last_decrease: Optional[float] = None
+
+    async def __aenter__(self) -> "AdaptiveRateLimiter":
+        await self._sem.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        self._sem.release()
+
+    async def wait_turn(self) -> None:
+        """Sleeps until this caller's slot in the current rate schedule comes up."""
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            # Reserve the slot before sleeping so concurrent callers queue up behind it.
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + 1.0 / self.rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            if loop.time() >= self._paused_until:
+                return
+            # A throttle arrived while we slept on our slot; queue again behind the pause.
+
+    def on_success(self) -> None:
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self, retry_after: Optional[float] = None) -> None:
+        now = asyncio.get_running_loop().time()
+        # A burst of in-flight requests all throttled by the same congestion counts once:
+        # decrease at most once per window (one interval at the current rate, or a pause).
+        in_window = (now < self._paused_until or
+                     (self._last_decrease is not None and now - self._last_decrease < 1.0 / self.rate))
+        if not in_window:
+            self.rate = max(self.min_rate, self.rate / 2)
+            self._last_decrease = now
+        if retry_after:
+            resume_at = now + retry_after
+            self._paused_until = max(self._paused_until, resume_at)
+            self._next_slot = max(self._next_slot, resume_at)
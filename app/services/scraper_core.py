@@ -3,12 +3,40 @@
 # and use the command: python -m app.services.scraper_core
 # FIRST TIME SETUP: run `pip install playwright` and then `playwright install`
 
+import argparse
 import asyncio
+import hashlib
+import logging
+import logging.handlers
+import os
+import queue
 import random
+import re
+import sys
 from duckduckgo_search import DDGS
-from trafilatura import extract
-from typing import List, Set, Optional
-from playwright.async_api import async_playwright
+from duckduckgo_search.exceptions import RatelimitException
+try:
+    # Native async client; duckduckgo_search >= 7 dropped it and only ships the sync DDGS.
+    from duckduckgo_search import AsyncDDGS
+except ImportError:
+    AsyncDDGS = None
+# 4.x/5.x ship AsyncDDGS without atext() (4.x's text() is an async generator); use the sync path there.
+if AsyncDDGS is not None and not hasattr(AsyncDDGS, "atext"):
+    AsyncDDGS = None
+from trafilatura import extract, html2txt
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import dataclass
+from operator import attrgetter
+from pathlib import Path
+from typing import Dict, List, Set, Optional
+from urllib.parse import urlsplit, urlunsplit
+from playwright.async_api import BrowserContext, Page, async_playwright
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+
+from app.services.content_cache import ContentCache
+from app.services.http_client import close_client
+
+logger = logging.getLogger(__name__)
 
 # --- Configuration ---
 
@@ -33,11 +61,20 @@ SEARCH_QUERIES = [
     "best bank account promotions",
 ]
 
+# Search fan-out: results per query (kept low to be less aggressive) and
+# how many queries may be in flight against DuckDuckGo at once.
+SEARCH_MAX_RESULTS = 3
+SEARCH_CONCURRENCY = 8
+
+# Max pages fetched at once; unbounded fan-out just trades throughput for 429s and timeouts.
+FETCH_CONCURRENCY = 16
+
 # Domains to exclude from search results
 EXCLUDED_DOMAINS = [
     "google.com", "youtube.com", "facebook.com", "twitter.com",
     "linkedin.com", "instagram.com", "pinterest.com", "duckduckgo.com"
 ]
+_EXCLUDED_DOMAINS = frozenset(EXCLUDED_DOMAINS)
 
 # Failsafe URLs if all web searches fail
 FAILSAFE_URLS = [
@@ -47,75 +84,157 @@ FAILSAFE_URLS = [
     "https://www.nerdwallet.com/best/credit-cards/sign-up-bonus",
 ]
 
+# Keywords that mark a page as a high-confidence opportunity
+HIGH_CONFIDENCE_KEYWORDS = [
+    "bonus", "grant", "rebate", "scholarship", "claim", "settlement", "unclaimed",
+    "sign-up bonus", "welcome offer", "statement credit", "annual fee waived",
+    "companion pass", "lounge access"
+]
+
+# All keywords folded into one compiled, case-insensitive pattern, so a page is scanned in a
+# single C-level pass over the original text. The leading \b keeps "claim" from matching
+# "disclaimer" while still letting "bonus" match "bonuses".
+_KEYWORD_RE = re.compile(
+    r"\b(?:" + "|".join(re.escape(kw) for kw in HIGH_CONFIDENCE_KEYWORDS) + ")",
+    re.IGNORECASE,
+)
+
+# trafilatura settings for the keyword-only analysis path: plain text is all we need, so skip
+# the slow fallback extractors (`fast`, trafilatura >= 1.10) and every optional structure.
+EXTRACT_KW = dict(
+    fast=True,
+    include_comments=False,
+    include_tables=False,
+    include_links=False,
+    include_images=False,
+    include_formatting=False,
+)
+
+# Opportunity pages name the offer in the headline/lede, so the first pass only reads this much
+# of the <body>; footers and trailing scripts can be many times larger.
+HEAD_BYTES = 64 * 1024
+
+def extract_page_text(html_content: str) -> Optional[str]:
+    """
+    Two-stage extraction: html2txt over the start of the body is a cheap first pass,
+    good enough to reject pages with no keyword. Only pages that hit a keyword pay for
+    the full extract() of the whole document.
+    """
+    # Slice from <body> so large inline <head> scripts/styles don't eat the budget. The slice needs
+    # an "<html>" prefix: trafilatura's loader rejects input that doesn't open like a document.
+    body_start = max(html_content.find("<body"), 0)
+    quick_text = html2txt("<html>" + html_content[body_start:body_start + HEAD_BYTES])
+    if not quick_text or not _KEYWORD_RE.search(quick_text):
+        return quick_text
+    return extract(html_content, **EXTRACT_KW)
+
 # --- Mock AI Analysis Function ---
+@dataclass(slots=True, frozen=True)
 class MockOpportunity:
-    def __init__(self, title: str, trust_score: int, source_url: str, summary: str = ""):
-        self.title = title
-        self.trust_score = trust_score
-        self.source_url = source_url
-        self.summary = summary
+    title: str
+    trust_score: int
+    source_url: str
+    summary: str = ""
 
 def analyze_opportunity_with_ai(text_content: str, source_url: str) -> Optional[MockOpportunity]:
-    print(f"🤖 AI: Analyzing content from: {source_url}")
-    text_lower = text_content.lower()
-    high_confidence_keywords = [
-        "bonus", "grant", "rebate", "scholarship", "claim", "settlement", "unclaimed",
-        "sign-up bonus", "welcome offer", "statement credit", "annual fee waived",
-        "companion pass", "lounge access"
-    ]
-    if any(keyword in text_lower for keyword in high_confidence_keywords):
-        print("  - ✅ AI: High-confidence keyword found.")
+    logger.debug("🤖 AI: Analyzing content from: %s", source_url)
+    if _KEYWORD_RE.search(text_content):
+        logger.debug("  - ✅ AI: High-confidence keyword found.")
         return MockOpportunity(title="Potential Financial Opportunity Found", trust_score=7, source_url=source_url)
     elif len(text_content) > 500:
-         print("  - ⚠️ AI: No high-confidence keywords, substantial content.")
+         logger.debug("  - ⚠️ AI: No high-confidence keywords, substantial content.")
          return MockOpportunity(title="Low-Confidence Opportunity", trust_score=3, source_url=source_url)
-    print(f"  - ❌ AI: Content from {source_url} is too short or irrelevant.")
+    logger.debug("  - ❌ AI: Content from %s is too short or irrelevant.", source_url)
     return None
 
 # --- Core Scraper Class ---
 class ScraperCore:
-    def __init__(self, search_queries: List[str], browser):
+    def __init__(self, search_queries: List[str], context: BrowserContext,
+                 cache: Optional[ContentCache] = None, force_refresh: bool = False,
+                 extractor: Optional[Executor] = None):
         self.search_queries = search_queries
-        self.browser = browser
+        # One shared context: pages opened from it reuse DNS, keep-alive sockets and TLS sessions.
+        self.context = context
+        self.cache = cache
+        self.force_refresh = force_refresh
+        # Where CPU-bound extraction runs; None means the loop's default thread pool.
+        self.extractor = extractor
+        # Fingerprints of page text already analyzed this run (mirrors and reposts share text).
+        self._seen_fingerprints: Set[bytes] = set()
+        self._sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+        self._idle_pages: "asyncio.Queue[Page]" = asyncio.Queue()
 
     def _is_valid_link(self, url: str) -> bool:
-        if not url or not url.startswith("http"): return False
+        if not url or not url.startswith(("http://", "https://")): return False
         try:
-            domain = url.split("://")[1].split("/")[0]
-            if any(excluded in domain for excluded in EXCLUDED_DOMAINS): return False
-        except IndexError: return False
-        return True
+            host = urlsplit(url).hostname or ""
+        except ValueError:  # e.g. "Invalid IPv6 URL" on a malformed href
+            return False
+        if not host: return False
+        # Look up the host and each parent domain: blocks "m.youtube.com" but not "my-google.com".
+        labels = host.split(".")
+        return not any(".".join(labels[i:]) in _EXCLUDED_DOMAINS for i in range(len(labels)))
 
-    async def discover_urls(self) -> Set[str]:
-        all_links = set()
-        print(f"🌱 Starting URL discovery for {len(self.search_queries)} queries...")
-        try:
-            with DDGS() as ddgs:
-                for query in self.search_queries:
-                    print(f"  -> Searching for: '{query}'")
-                    results = list(ddgs.text(query, max_results=3)) # Fewer results to be less aggressive
-                    if not results:
-                        print("     - No results found.")
-                        continue
-                    
-                    for result in results:
-                        url = result.get('href')
-                        if self._is_valid_link(url):
-                            all_links.add(url)
-                    
+    @staticmethod
+    def _normalize_url(url: str) -> str:
+        """Dedup key: drops the fragment and trailing slash so trivially different links match."""
+        parts = urlsplit(url)
+        path = parts.path.rstrip("/")
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, parts.query, ""))
+
+    @staticmethod
+    async def _run_search(query: str) -> List[dict]:
+        if AsyncDDGS is not None:
+            async with AsyncDDGS() as ddgs:
+                return list(await ddgs.atext(query, max_results=SEARCH_MAX_RESULTS))
+        # Fallback: keep the blocking client off the event loop.
+        return await asyncio.to_thread(
+            lambda: list(DDGS().text(query, max_results=SEARCH_MAX_RESULTS))
+        )
+
+    async def _search_one(self, query: str, sem: asyncio.Semaphore) -> List[dict]:
+        """Runs one DuckDuckGo search, bounded by `sem`."""
+        async with sem:
+            logger.debug("  -> Searching for: '%s'", query)
+            for attempt in range(2):
+                try:
+                    return await self._run_search(query)
+                except RatelimitException:
+                    if attempt:
+                        break
+                    # Back off only when DuckDuckGo actually rate-limits us.
                     delay = random.uniform(4, 8)
-                    print(f"     - Pausing for {delay:.1f} seconds to avoid rate limit...")
+                    logger.warning("     - Rate limited on '%s', retrying in %.1f seconds...", query, delay)
                     await asyncio.sleep(delay)
+                except Exception as e:
+                    logger.error("❗️❗️ An error during DuckDuckGo search for '%s': %s", query, e)
+                    break
+            return []
+
+    async def discover_urls(self) -> Set[str]:
+        # Normalized form -> first URL seen: dedupe on the key, but fetch what the search returned.
+        all_links: Dict[str, str] = {}
+        logger.info("🌱 Starting URL discovery for %d queries...", len(self.search_queries))
+        sem = asyncio.Semaphore(SEARCH_CONCURRENCY)
+        results_per_query = await asyncio.gather(
+            *[self._search_one(query, sem) for query in self.search_queries]
+        )
 
-        except Exception as e:
-            print(f"❗️❗️ An error during DuckDuckGo search: {e}")
+        for query, results in zip(self.search_queries, results_per_query):
+            if not results:
+                logger.debug("     - No results found for '%s'.", query)
+                continue
+            for result in results:
+                url = result.get('href')
+                if self._is_valid_link(url):
+                    all_links.setdefault(self._normalize_url(url), url)
 
         if not all_links:
-            print("\n⚠️ Live search failed. Switching to failsafe URLs.\n")
+            logger.warning("⚠️ Live search failed. Switching to failsafe URLs.")
             return set(FAILSAFE_URLS)
         
-        print(f"🌱 Discovered {len(all_links)} unique URLs.\n")
-        return all_links
+        logger.info("🌱 Discovered %d unique URLs.", len(all_links))
+        return set(all_links.values())
 
     async def process_links(self, urls: Set[str]) -> List[MockOpportunity]:
         tasks = [self._fetch_and_analyze(url) for url in urls]
@@ -123,71 +242,150 @@ class ScraperCore:
         return [result for result in results if result]
 
     async def _fetch_and_analyze(self, url: str) -> Optional[MockOpportunity]:
+        cached = None if self.cache is None or self.force_refresh else self.cache.get(url)
+        if cached and cached.text:
+            logger.debug("💾 Cache hit: %s", url)
+            text_content = cached.text
+        else:
+            if cached:
+                # Extraction came up empty last time; retry it on the stored HTML, no re-download.
+                logger.debug("💾 Cache hit without text, re-extracting: %s", url)
+                html_content = cached.html
+            else:
+                html_content = await self._fetch_html(url)
+                if html_content is None:
+                    return None
+            try:
+                # Parse off the event loop so other fetches keep progressing meanwhile.
+                loop = asyncio.get_running_loop()
+                text_content = await loop.run_in_executor(self.extractor, extract_page_text, html_content)
+            except Exception as e:
+                logger.error("  - ❗️❗️ Extraction failed for %s: %s", url, e)
+                return None
+            if self.cache is not None:
+                self.cache.put(url, html_content, text_content)
+
+        if not text_content:
+            logger.debug("  - ❗️ Could not extract main content from %s.", url)
+            return None
+
+        fingerprint = hashlib.blake2b(text_content[:4096].encode("utf-8"), digest_size=16).digest()
+        if fingerprint in self._seen_fingerprints:
+            logger.debug("  - ⏭️ Skipping %s: same content as a page already analyzed.", url)
+            return None
+        self._seen_fingerprints.add(fingerprint)
+        
+        return analyze_opportunity_with_ai(text_content, source_url=url)
+
+    async def _fetch_html(self, url: str) -> Optional[str]:
         """Uses Playwright to fetch content like a real browser."""
-        page = None
-        try:
-            print(f"📰 Fetching with Playwright: {url}")
-            page = await self.browser.new_page()
-            await page.goto(url, wait_until='domcontentloaded', timeout=30000) # 30s timeout
-            
-            # Wait for a common sign that the page has settled
-            await page.wait_for_timeout(2000) 
+        async with self._sem:
+            # Reuse an idle page when there is one; the semaphore caps how many ever exist.
+            page = None if self._idle_pages.empty() else self._idle_pages.get_nowait()
+            try:
+                logger.debug("📰 Fetching with Playwright: %s", url)
+                if page is None:
+                    page = await self.context.new_page()
+                await page.goto(url, wait_until='domcontentloaded', timeout=30000) # 30s timeout
+                
+                # Give late scripts a moment to settle, but return as soon as the network is quiet
+                try:
+                    await page.wait_for_load_state('networkidle', timeout=5000)
+                except PlaywrightTimeoutError:
+                    pass
 
-            html_content = await page.content()
-            
-            text_content = extract(html_content, include_comments=False, include_tables=False)
-            
-            if not text_content:
-                print(f"  - ❗️ Could not extract main content from {url}.")
+                html_content = await page.content()
+            except Exception as e:
+                logger.warning("  - ❗️❗️ Unexpected error processing %s: %s", url, e)
+                # A page that failed (timeout, crash, bad navigation) may be unusable; drop it.
+                if page is not None and not page.is_closed():
+                    try:
+                        await page.close()
+                    except Exception:
+                        pass
                 return None
-            
-            return analyze_opportunity_with_ai(text_content, source_url=url)
-        except Exception as e:
-            print(f"  - ❗️❗️ Unexpected error processing {url}: {e}")
-            return None
-        finally:
-            if page:
-                await page.close()
+            self._idle_pages.put_nowait(page)
+            return html_content
 
 # --- Main Execution Logic ---
-async def main():
-    print("--- SCRIPT STARTED: PLAYWRIGHT MODE ---")
+def configure_logging(verbose: bool = False) -> logging.handlers.QueueListener:
+    """
+    Routes all records through a queue drained by a background thread, so coroutines
+    only enqueue and never block on stderr. Callers must stop() the returned listener.
+    """
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    root = logging.getLogger()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(logging.INFO)
+    if verbose:
+        # Only our own per-URL chatter; third-party DEBUG logs stay off. `logger` covers `-m` runs.
+        logging.getLogger("app").setLevel(logging.DEBUG)
+        logger.setLevel(logging.DEBUG)
+    listener.start()
+    return listener
+
+async def main(force_refresh: bool = False):
+    logger.info("--- SCRIPT STARTED: PLAYWRIGHT MODE ---")
     
-    async with async_playwright() as p:
-        browser = await p.chromium.launch()
-        
-        scraper = ScraperCore(SEARCH_QUERIES, browser)
-        
-        urls_to_scan = await scraper.discover_urls()
-        if not urls_to_scan:
-            print("🛑 CRITICAL ERROR: No URLs to scan. Cannot proceed.")
-            await browser.close()
-            return
+    cache = ContentCache()
+    extractor = ProcessPoolExecutor(max_workers=os.cpu_count())
+    try:
+        async with async_playwright() as p:
+            browser = await p.chromium.launch()
+            # browser.new_page() would create a throwaway context per URL; share one instead.
+            context = await browser.new_context()
+            
+            scraper = ScraperCore(SEARCH_QUERIES, context, cache=cache,
+                                  force_refresh=force_refresh, extractor=extractor)
+            
+            urls_to_scan = await scraper.discover_urls()
+            if not urls_to_scan:
+                logger.critical("🛑 CRITICAL ERROR: No URLs to scan. Cannot proceed.")
+                await browser.close()
+                return
 
-        print(f"🕵️ Processing {len(urls_to_scan)} URLs through the AI filter...")
-        all_opportunities = await scraper.process_links(urls_to_scan)
-        
-        await browser.close()
+            logger.info("🕵️ Processing %d URLs through the AI filter...", len(urls_to_scan))
+            all_opportunities = await scraper.process_links(urls_to_scan)
+            
+            await browser.close()
+    finally:
+        extractor.shutdown()
+        cache.close()
+        # Release the shared pooled client (if anything opened it) while this loop is still running.
+        await close_client()
         
     final_opportunities = [opp for opp in all_opportunities if opp.trust_score >= 5]
-    print(f"\n✅ Found {len(final_opportunities)} valid opportunities with trust score >= 5:\n")
+    logger.info("✅ Found %d valid opportunities with trust score >= 5:", len(final_opportunities))
 
     if final_opportunities:
-        final_opportunities.sort(key=lambda x: x.trust_score, reverse=True)
-        output_lines = [f"- {opp.title} ({opp.trust_score}/10)\n  Source: {opp.source_url}\n" for opp in final_opportunities]
-        for line in output_lines:
-            print(line)
-        with open("financial_opportunities.txt", "w", encoding="utf-8") as f:
-            f.write("\n".join(output_lines))
-        print("\n📄 Results saved to financial_opportunities.txt")
+        ranked = sorted(final_opportunities, key=attrgetter("trust_score"), reverse=True)
+        # Format once, then emit the same string to stdout and the file in one write each.
+        # The report goes straight to stdout (logs go to stderr), so it can be redirected.
+        output = "\n".join(
+            f"- {opp.title} ({opp.trust_score}/10)\n  Source: {opp.source_url}\n" for opp in ranked
+        )
+        sys.stdout.write(output + "\n")
+        Path("financial_opportunities.txt").write_text(output, encoding="utf-8")
+        logger.info("📄 Results saved to financial_opportunities.txt")
     else:
-        print("  - No pages met the final trust score threshold of 5.")
+        logger.info("  - No pages met the final trust score threshold of 5.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Discover and score financial opportunities.")
+    parser.add_argument("--force-refresh", action="store_true",
+                        help="Ignore the on-disk page cache and re-fetch every URL.")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Log per-URL progress (fetches, cache hits, AI decisions).")
+    args = parser.parse_args()
+    listener = configure_logging(args.verbose)
     try:
-        asyncio.run(main())
+        asyncio.run(main(force_refresh=args.force_refresh))
     except Exception as e:
-        print(f"💥 An unexpected error occurred at the top level: {e}")
+        logger.critical("💥 An unexpected error occurred at the top level: %s", e)
     finally:
-        print("--- SCRIPT FINISHED ---")
+        logger.info("--- SCRIPT FINISHED ---")
+        listener.stop()
 
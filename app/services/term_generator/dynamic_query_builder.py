@@ -2,29 +2,139 @@
 # This module expands our search query list dynamically by scraping Google.
 
 import asyncio
+import functools
+import html
+import logging
+import random
+import re
 import httpx
-from bs4 import BeautifulSoup
-from typing import List, Set
+from lxml import etree
+from typing import Dict, FrozenSet, List, Optional, Tuple
 import urllib.parse
 
-# Headers to mimic a real browser visit for scraping Google
-HEADERS = {
-    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-    'Accept-Language': 'en-US,en;q=0.9',
-    'Accept-Encoding': 'gzip, deflate, br',
-    'Connection': 'keep-alive',
-    'DNT': '1',
-    'Upgrade-Insecure-Requests': '1'
-}
+from app.services.content_cache import RelatedTermsCache
+from app.services.http_client import USER_AGENTS, get_client
+from app.services.rate_limiter import AdaptiveRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Max Google requests in flight at once; bursting every seed just earns 429s and empty pages.
+EXPANSION_CONCURRENCY = 8
+# Starting request rate (per second); the limiter adapts it to how Google responds.
+EXPANSION_RATE = 4.0
+
+# Transient failures worth another try, and how hard to try.
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+# Responses that mean "slow down" rather than "something broke".
+THROTTLE_STATUSES = frozenset({429, 503})
+MAX_ATTEMPTS = 3
+MAX_RETRY_DELAY = 30.0
+
+# Stop expanding after this many consecutive seeds contribute no new terms.
+EARLY_STOP_PATIENCE = 5
+
+# Seeds this similar (Jaccard over character 3-grams) to one already covered are not expanded;
+# "free money apps" vs "free money app" scores ~0.92, distinct intents stay well below.
+NEAR_DUPLICATE_THRESHOLD = 0.9
+_SHINGLE_SIZE = 3
+
+# The page is pull-parsed in slices of this size so finished subtrees are freed as we go.
+_PARSE_CHUNK = 64 * 1024
+
+# Compiled once at import and evaluated in C against each collected container,
+# instead of Python-level find/iter walks per request.
+_RELATED_LINKS_XP = etree.XPath(".//a")
+_TEXT_XP = etree.XPath("string()")
+
+# "People also ask" entries are a narrow, stable pattern: the question is the first plain-text
+# <span> inside the jsname="Cpkphb" container, so it's read straight from the raw bytes.
+# The gap is bounded so an entry without a span can't match text from far down the page.
+_PAA_RE = re.compile(rb'jsname="Cpkphb"[^>]*>.{0,1000}?<span[^>]*>([^<]{4,200})</span>', re.S)
+
+# Navigation/UI fragments and bare links that show up among related-search anchors.
+_REJECT_RE = re.compile(r"›|See more|Learn more|https?://", re.IGNORECASE)
+
+@functools.lru_cache(maxsize=4096)
+def _build_search_url(query: str) -> str:
+    # URL-encode the query properly; pure and deterministic, so repeat seeds reuse the result.
+    return f"https://www.google.com/search?q={urllib.parse.quote_plus(query)}&gl=us&hl=en"
+
+def _shingles(text: str) -> FrozenSet[str]:
+    text = " ".join(text.split())
+    return frozenset(text[i:i + _SHINGLE_SIZE] for i in range(max(len(text) - _SHINGLE_SIZE + 1, 1)))
+
+def _jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b)
+
+def _is_target(div) -> bool:
+    # The main "Related searches" block at the bottom of the page.
+    return div.get('id') == 'bres'
+
+def _collect_from_target(div, terms: List[str]):
+    # str() detaches XPath string results from the tree so cleared nodes can be freed.
+    terms.extend(str(_TEXT_XP(link)) for link in _RELATED_LINKS_XP(div))
+
+def _extract_candidate_terms(body: bytes) -> List[str]:
+    """Collects related-search and "People also ask" terms from a raw results page."""
+    return _related_search_terms(body) + _people_also_ask_terms(body)
+
+def _people_also_ask_terms(body: bytes) -> List[str]:
+    return [html.unescape(match.decode('utf-8', 'ignore')) for match in _PAA_RE.findall(body)]
+
+def _related_search_terms(body: bytes) -> List[str]:
+    """
+    Pull-parses a results page and keeps text only from the #bres container.
+    Every other <div> is cleared as soon as it closes, so the full DOM of a
+    ~500KB SERP is never held in memory at once.
+    """
+    # Google serves UTF-8; declaring it skips encoding detection on the raw bytes.
+    parser = etree.HTMLPullParser(events=('start', 'end'), tag='div', encoding='utf-8')
+    terms: List[str] = []
+    open_targets = 0
+
+    def drain():
+        nonlocal open_targets
+        for event, div in parser.read_events():
+            if _is_target(div):
+                if event == 'start':
+                    open_targets += 1
+                    continue
+                open_targets -= 1
+                _collect_from_target(div, terms)
+            elif event == 'start':
+                continue
+            # Never free anything while a target's subtree is still being read.
+            if not open_targets:
+                div.clear()
+                # Drop already-processed siblings too, not just this subtree.
+                while div.getprevious() is not None:
+                    del div.getparent()[0]
+
+    for offset in range(0, len(body), _PARSE_CHUNK):
+        parser.feed(body[offset:offset + _PARSE_CHUNK])
+        drain()
+    parser.close()
+    drain()
+    return terms
 
 class DynamicQueryBuilder:
     """
     Expands a list of seed queries by scraping "Related searches" from Google.
     This makes our scraper smarter by discovering new search vectors automatically.
     """
-    def __init__(self, initial_queries: List[str]):
-        self.initial_queries = initial_queries
-        self.expanded_queries: Set[str] = set(initial_queries)
+    def __init__(self, initial_queries: List[str], cache: Optional[RelatedTermsCache] = None):
+        # Normalized (casefolded, stripped) query -> first spelling seen, so case variants dedupe.
+        self.expanded_queries: Dict[str, str] = {}
+        for query in initial_queries:
+            self.expanded_queries.setdefault(self._normalize(query), query)
+        # Unique seeds only; a repeated seed would just repeat the same Google request.
+        self.initial_queries = list(self.expanded_queries.values())
+        self.cache = cache
+        # Normalized query -> future for a request already in flight.
+        self._inflight: Dict[str, asyncio.Future] = {}
+        # Set once Google soft-blocks us (403/429); remaining seeds are skipped, not retried.
+        self._blocked = False
+        self._limiter = AdaptiveRateLimiter(rate=EXPANSION_RATE, max_at_once=EXPANSION_CONCURRENCY)
 
     async def expand_queries(self) -> List[str]:
         """
@@ -33,66 +143,255 @@ class DynamicQueryBuilder:
         Returns:
             A deduplicated list of all initial and discovered queries.
         """
-        print("🧠 Starting query expansion process...")
-        async with httpx.AsyncClient(headers=HEADERS, follow_redirects=True, timeout=10.0) as client:
-            tasks = [self._fetch_related_for_query(client, query) for query in self.initial_queries]
-            await asyncio.gather(*tasks)
+        logger.debug("🧠 Starting query expansion process...")
+        known_before = len(self.expanded_queries)
+        cached_hits = failed = 0
+        # Serve what we can from the cache; only misses go out to Google.
+        uncached = []
+        for query in self.initial_queries:
+            terms = self.cache.get(self._normalize(query)) if self.cache is not None else None
+            if terms is None:
+                uncached.append(query)
+            else:
+                cached_hits += 1
+                logger.debug("  - 💾 Cached related terms for '%s'", query)
+                self._merge(query, terms)
+
+        uncached = self._drop_near_duplicates(uncached)
+
+        # Shared pooled client: keep-alive connections to Google survive across seeds and calls.
+        client = get_client()
+        if uncached:
+            await self._warm_up(client)
+        tasks = [asyncio.create_task(self._fetch_related_for_query(client, query)) for query in uncached]
 
-        print(f"🧠 Query expansion complete. Total queries now: {len(self.expanded_queries)}")
-        return list(self.expanded_queries)
+        # Merge each seed's terms as soon as it finishes. Once several seeds in a row add
+        # nothing new the related-search space has plateaued, so cancel what's left.
+        idle_streak = 0
+        for next_done in asyncio.as_completed(tasks):
+            query, terms = await next_done
+            if terms is None:
+                failed += 1
+                continue
+            idle_streak = 0 if self._merge(query, terms) else idle_streak + 1
+            if idle_streak >= EARLY_STOP_PATIENCE:
+                pending = [task for task in tasks if not task.done()]
+                if pending:
+                    logger.debug("  - ⏹️ %d seeds in a row added nothing new; skipping %d remaining.", idle_streak, len(pending))
+                    for task in pending:
+                        task.cancel()
+                    await asyncio.gather(*pending, return_exceptions=True)
+                break
 
-    async def _fetch_related_for_query(self, client: httpx.AsyncClient, query: str):
+        logger.info(
+            "🧠 Query expansion complete: +%d terms from %d seeds (%d cached, %d failed). Total queries now: %d",
+            len(self.expanded_queries) - known_before, len(self.initial_queries), cached_hits, failed,
+            len(self.expanded_queries),
+        )
+        return list(self.expanded_queries.values())
+
+    @staticmethod
+    async def _warm_up(client: httpx.AsyncClient):
+        """
+        Opens the pooled connection to Google with one cheap request before the burst,
+        so the seeds share it (multiplexed under HTTP/2) instead of each racing to
+        resolve DNS and handshake their own.
+        """
+        try:
+            await client.head("https://www.google.com/", timeout=5.0)
+        except httpx.HTTPError as e:
+            logger.debug("  - Warm-up request to Google failed (%s); continuing anyway.", e)
+
+    def _drop_near_duplicates(self, seeds: List[str]) -> List[str]:
+        """
+        Skips seeds that are near-identical to a query we already know (or to a seed
+        kept earlier in this list): their related searches would mostly overlap, so
+        the request isn't worth making. Skipped seeds still appear in the results.
+        """
+        pending = {self._normalize(query) for query in seeds}
+        covered = [_shingles(key) for key in self.expanded_queries if key not in pending]
+        kept = []
+        for query in seeds:
+            shingles = _shingles(self._normalize(query))
+            if any(_jaccard(shingles, other) >= NEAR_DUPLICATE_THRESHOLD for other in covered):
+                logger.debug("  - Skipping '%s': near-duplicate of a query already covered.", query)
+                continue
+            kept.append(query)
+            covered.append(shingles)
+        return kept
+
+    @staticmethod
+    def _normalize(query: str) -> str:
+        # casefold() rather than lower(): full Unicode folding, so e.g. "ß" and "ss" match.
+        return query.casefold().strip()
+
+    def _merge(self, query: str, terms: List[str]) -> int:
+        """
+        Adds the terms not already known, keeping whichever spelling came first.
+
+        Returns:
+            How many new terms were added.
+        """
+        new_terms = []
+        for term in terms:
+            # Normalize once per term; the check and the insert share the key.
+            key = self._normalize(term)
+            if key in self.expanded_queries:
+                continue
+            self.expanded_queries[key] = term
+            new_terms.append(term)
+        if new_terms:
+            logger.debug("  - Found new terms: %s", new_terms)
+        else:
+            logger.debug("  - No new related terms found for '%s'. Google's layout may have changed.", query)
+        return len(new_terms)
+
+    async def _fetch_related_for_query(
+        self, client: httpx.AsyncClient, query: str
+    ) -> Tuple[str, Optional[List[str]]]:
+        """
+        Fetches (and caches) related terms for one seed. Concurrent calls for the same
+        normalized query share a single in-flight request instead of repeating it.
+
+        Returns:
+            The seed and its cleaned terms, or None for the terms if the request failed.
+        """
+        key = self._normalize(query)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            # Shielded: a cancelled follower must not cancel the future the owner resolves.
+            return query, await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        terms = None
+        try:
+            terms = await self._scrape_related_terms(client, query)
+            if terms is not None:
+                # An empty result is more likely a blocked or changed page than a real
+                # answer, so only non-empty results are cached.
+                if terms and self.cache is not None:
+                    self.cache.put(key, terms)
+        finally:
+            del self._inflight[key]
+            if not future.done():
+                future.set_result(terms)
+        return query, terms
+
+    @staticmethod
+    def _retry_after(response: Optional[httpx.Response]) -> Optional[float]:
+        """Returns a numeric Retry-After header in seconds (capped), if the response has one."""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), MAX_RETRY_DELAY)
+        return None
+
+    @classmethod
+    def _retry_delay(cls, attempt: int, response: Optional[httpx.Response]) -> float:
+        """Honors a numeric Retry-After header, else exponential backoff with jitter."""
+        retry_after = cls._retry_after(response)
+        if retry_after is not None:
+            return retry_after
+        return min(2 ** attempt, 8) + random.random() * 0.3
+
+    async def _get_with_retry(self, client: httpx.AsyncClient, url: str, query: str) -> httpx.Response:
+        """
+        GETs the URL, retrying 429/5xx responses and network errors. Callers hold a
+        limiter slot, so backing off also keeps the slot and retries can't stampede Google;
+        every attempt also waits its turn in the limiter's adaptive rate schedule.
+        Returns the last response, or re-raises the last network error.
+        """
+        response: Optional[httpx.Response] = None
+        error: Optional[httpx.TransportError] = None
+        for attempt in range(MAX_ATTEMPTS):
+            last_attempt = attempt == MAX_ATTEMPTS - 1
+            await self._limiter.wait_turn()
+            try:
+                response = await client.get(url, headers={'User-Agent': random.choice(USER_AGENTS)})
+            except httpx.TransportError as e:
+                if last_attempt:
+                    raise
+                response, error = None, e
+            else:
+                # Successes are reported by the caller, which can tell a block page from results.
+                if response.status_code in THROTTLE_STATUSES:
+                    self._limiter.on_throttle(self._retry_after(response))
+                if last_attempt or response.status_code not in RETRYABLE_STATUSES:
+                    return response
+            delay = self._retry_delay(attempt, response)
+            logger.debug("  - Retrying '%s' in %.1fs (attempt %d/%d)...", query, delay, attempt + 2, MAX_ATTEMPTS)
+            await asyncio.sleep(delay)
+        # Only reachable if MAX_ATTEMPTS < 1; never fall through to an implicit None.
+        if response is not None:
+            return response
+        raise error or httpx.TransportError(f"No attempts made for {url}")
+
+    async def _scrape_related_terms(self, client: httpx.AsyncClient, query: str) -> Optional[List[str]]:
         """
         Scrapes a Google search results page for a single query to find related terms.
+
+        Returns:
+            The cleaned terms (not yet deduped against this run), or None if the
+            request failed.
         """
         try:
-            # URL-encode the query properly
-            encoded_query = urllib.parse.quote_plus(query)
-            search_url = f"https://www.google.com/search?q={encoded_query}&gl=us&hl=en"
-            print(f"  -> Expanding from seed: '{query}'")
-            response = await client.get(search_url)
+            search_url = _build_search_url(query)
+            async with self._limiter:
+                # Checked after queueing, so seeds waiting for a slot see a block.
+                if self._blocked:
+                    logger.debug("  - Skipping '%s': Google is blocking requests.", query)
+                    return None
+                logger.debug("  -> Expanding from seed: '%s'", query)
+                response = await self._get_with_retry(client, search_url, query)
             
+            # Still rate-limited after the retries, or outright forbidden: stop for this run.
+            if response.status_code in (403, 429):
+                logger.warning("  - 🛑 Google soft-blocked '%s' (status %d). Stopping expansion.", query, response.status_code)
+                self._blocked = True
+                return None
+
             if response.status_code != 200:
-                print(f"  - ❗️ Failed to fetch Google results for '{query}'. Status: {response.status_code}")
-                # Optional: Write response.text to a file for debugging what Google sent back
-                # with open(f"error_{query[:10]}.html", "w", encoding="utf-8") as f:
-                #     f.write(response.text)
-                return
+                logger.debug("  - ❗️ Failed to fetch Google results for '%s'. Status: %d", query, response.status_code)
+                # Optional: Write the raw body to a file for debugging what Google sent back
+                # with open(f"error_{query[:10]}.html", "wb") as f:
+                #     f.write(response.content)
+                return None
+
+            body = response.content
+            # The "unusual traffic" interstitial lives under /sorry/ and carries a captcha form.
+            if response.url.path.startswith("/sorry/") or b'id="captcha-form"' in body:
+                logger.warning("  - 🛑 Google served a CAPTCHA for '%s'. Stopping expansion.", query)
+                self._blocked = True
+                self._limiter.on_throttle()
+                return None
+
+            # A results page with neither container has nothing to parse. Not a success
+            # for the limiter either, and the empty result is never cached.
+            if b'id="bres"' not in body and b'jsname="Cpkphb"' not in body:
+                logger.debug("  - No result containers in response for '%s' (%d bytes).", query, len(body))
+                return []
+            self._limiter.on_success()
 
-            soup = BeautifulSoup(response.text, 'html.parser')
-            
             # --- NEW ROBUST METHOD ---
             # Instead of a single selector, we check multiple known containers.
-            found_new_terms = set()
-            
-            # Selector for the main "Related searches" block at the bottom
-            related_searches_div = soup.find('div', id='bres')
-            if related_searches_div:
-                links = related_searches_div.find_all('a')
-                for link in links:
-                    found_new_terms.add(link.get_text(strip=True))
-
-            # Selector for "People also ask" sections
-            people_also_ask_divs = soup.find_all('div', jsname='Cpkphb')
-            for div in people_also_ask_divs:
-                question = div.find('span')
-                if question:
-                    found_new_terms.add(question.get_text(strip=True))
+            # Raw bytes go straight to lxml; response.text would decode the whole page in Python first.
+            found_new_terms = {term.strip() for term in _extract_candidate_terms(body)}
             
-            # Clean and filter the collected terms
-            final_new_terms = []
+            # Clean the collected terms into a local map first, deduped case-insensitively
+            final_new_terms: Dict[str, str] = {}
             for term in found_new_terms:
-                if term and len(term) > 3 and term.lower() not in self.expanded_queries:
-                    if "›" in term or "See more" in term:
-                        continue
-                    final_new_terms.append(term)
-
-
-            if final_new_terms:
-                print(f"  - Found new terms: {final_new_terms}")
-                self.expanded_queries.update(final_new_terms)
-            else:
-                print(f"  - No new related terms found for '{query}'. Google's layout may have changed.")
+                key = self._normalize(term)
+                # Cheapest rejection first; one regex scan covers the whole denylist.
+                if len(key) <= 3 or key in final_new_terms or _REJECT_RE.search(term):
+                    continue
+                final_new_terms[key] = term
+            return list(final_new_terms.values())
 
+        except httpx.HTTPError as e:
+            logger.debug("  - ❗️ Request for '%s' failed: %s", query, e)
+            return None
         except Exception as e:
-            print(f"  - ❗️❗️ An error occurred while expanding query '{query}': {e}")
+            # Anything else is a bug in our parsing, not Google; surface it (traceback under -v).
+            logger.warning("  - ❗️❗️ An error occurred while expanding query '%s': %s", query, e,
+                           exc_info=logger.isEnabledFor(logging.DEBUG))
+            return None